@@ -0,0 +1,459 @@
+"""
+Shared helpers and scan loop for the Boston parking ticket scraper.
+
+Cron drivers (extract-cron.py) build a ScrapeConfig and call run_main(config).
+"""
+
+import asyncio
+import aiohttp
+import orjson
+import csv
+import dataclasses
+import functools
+import random
+import os
+import re
+import signal
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from yarl import URL
+
+# API Config 
+BASE_HOST = "bostonma.rmcpay.com"
+SEARCH_PATH = "/rmcapi/api/violation_index.php/searchviolation"
+QS_TEMPLATE = ("operatorid=1582&violationnumber=%d&stateid=&lpn=&vin=&plate_type_id="
+               "&devicenumber=&payment_plan_id=&immobilization_id=&single_violation=0&omsessiondata=&")
+URL_FMT = f"https://{BASE_HOST}{SEARCH_PATH}?{QS_TEMPLATE}"
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Referer": f"https://{BASE_HOST}/",
+}
+
+# State files
+STATE_FILE = "state.json"  # last_vid, last_date, last_valid_vid, pass_count, gap_count
+SEEN_FILE = "seen_vids.txt"
+
+# Transport parameters--scan parameters come from the driver's config
+REQUEST_TIMEOUT = 12
+KEEPALIVE_TIMEOUT = 90  # keep idle connections past request_delay + BACKOFF_MAX so the TLS session is reused
+CONCURRENCY = 8  # max lookups in flight at once
+BATCH_SIZE = 20  # lookups started per batch; results are processed in VID order
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_AFTER_MAX = 60.0  # longest server-requested wait we honour
+
+CSV_OUT = "filtered_boston_tickets.csv"
+CSV_FIELDS = ["violation_number","date_utc","address","zonenumber","lpn","description"]
+ADDRESS_COL = CSV_FIELDS.index("address")
+DESCRIPTION_COL = CSV_FIELDS.index("description")
+
+
+# Per-driver scan parameters. Frozen so a config can't drift mid-run.
+@dataclasses.dataclass(frozen=True)
+class ScrapeConfig:
+    start_vid: int
+    keywords: tuple  # violation descriptions to keep, lowercase
+    chunk_size: int = 100
+    pass_limit: int = 2
+    gap_threshold: int = 10000
+    probe_after: int = 1000  # consecutive gaps before switching to strided probing
+    probe_stride: int = 100  # VIDs skipped between probes
+    request_delay: float = 7.5  # seconds between request starts, shared by all lookups
+
+# Helpers to load/save state and handle dates
+def load_state():
+    try:
+        with open(STATE_FILE, "rb") as f:
+            state = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+# Written to a temp file, fsynced, then renamed over the old one, so a crash leaves either
+# the old state or the new state--never a truncated file
+def save_state(state):
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(state, option=orjson.OPT_INDENT_2))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, STATE_FILE)
+
+# Tickets arrive in clusters that share timestamps, so repeated strings skip the parse
+@functools.lru_cache(maxsize=4096)
+def _parse_date_str(s):
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(s.replace("Z", "+00:00"))
+    except Exception:
+        return None
+
+# Only strings reach the cache--a dict/list from the API isn't hashable, and was never a date
+def parse_date(s):
+    if not isinstance(s, str):
+        return None
+    return _parse_date_str(s)
+
+# One bulk read, split on any whitespace in C; no per-line strip() or blank-line checks
+def load_seen():
+    if not os.path.exists(SEEN_FILE):
+        return set()
+    with open(SEEN_FILE, "rb") as f:
+        return {int(x) for x in f.read().split()}
+
+# seen_vids.txt is append-only: each kept VID is written once, when it is first seen
+def open_seen_log():
+    return open(SEEN_FILE, "a", buffering=1 << 16)
+
+def mark_seen(seen, seen_fh, vid):
+    seen.add(vid)
+    seen_fh.write(f"{vid}\n")
+
+# Flush, fsync and close a file kept open for the run
+def close_log(fh):
+    fh.flush()
+    os.fsync(fh.fileno())
+    fh.close()
+
+# HTTP Helper Functions
+# URL_FMT is already percent-encoded, so aiohttp is handed a prebuilt yarl.URL and skips re-parsing/quoting it
+def build_url(vid):
+    return URL(URL_FMT % vid, encoded=True)
+
+# Shared rate limiter: hands out request slots at most `rps` per second across all lookups.
+# 403/429s push the next slot out, backing off exponentially on consecutive strikes.
+class TokenBucket:
+    def __init__(self, rps):
+        self.interval = 1 / rps
+        self.lock = asyncio.Lock()
+        self.next = time.monotonic()
+        self.strikes = 0
+
+    # Re-checks after every sleep: a back_off() while we wait pushes self.next out and must hold us too
+    async def acquire(self):
+        async with self.lock:
+            while (now := time.monotonic()) < self.next:
+                await asyncio.sleep(self.next - now)
+            self.next = max(self.next, now) + self.interval
+
+    def defer(self, seconds):
+        self.next = max(self.next, time.monotonic() + seconds)
+
+    def reset(self):
+        self.strikes = 0
+
+    # A parsed Retry-After is used as-is (already capped at RETRY_AFTER_MAX); otherwise jittered exponential backoff
+    def back_off(self, status, retry_after=None):
+        if retry_after is not None:
+            wait = min(retry_after, RETRY_AFTER_MAX)
+        else:
+            wait = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.strikes) + random.random()*2
+        self.strikes += 1
+        print(f"[!] {status} backing off {wait:.1f}s")
+        self.defer(wait)
+
+# Retry-After is either delta-seconds or an HTTP-date. Capped so one reply can't stall the run past the cron slot.
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        wait = float(value)
+    else:
+        try:
+            wait = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(wait, 0.0), RETRY_AFTER_MAX)
+
+# Lookups wait for a bucket slot, but responses may overlap up to CONCURRENCY
+async def fetch_search(session, sem, bucket, vid):
+    async with sem:
+        await bucket.acquire()
+        try:
+            async with session.get(build_url(vid), timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) as resp:
+                if resp.status == 403:
+                    bucket.back_off("403")
+                    return ("403", None)
+                if resp.status == 429:
+                    bucket.back_off("429", parse_retry_after(resp.headers.get("Retry-After")))
+                    return ("429", None)
+                bucket.reset()
+                if resp.status == 404:
+                    return ("404", None)
+                if resp.status != 200:
+                    return ("err", f"status={resp.status}")
+                try:
+                    j = orjson.loads(await resp.read())
+                except Exception:
+                    return ("err", "invalid-json")
+        except Exception as e:
+            return ("err", str(e))
+    return ("ok", j)
+
+# True for missing/NULL user defined fields. Exact spellings are rejected before any string conversion.
+def is_blank(v):
+    if not v or v in ("null", "NULL", "Null"):
+        return True
+    v = str(v).strip()
+    return not v or v.lower() == "null"
+
+# All keywords as one alternation, so a description is scanned once instead of once per keyword.
+# Also returns the shortest keyword length: shorter descriptions cannot match.
+def compile_keywords(keywords):
+    return re.compile("|".join(re.escape(kw) for kw in keywords)), min(len(kw) for kw in keywords)
+
+# Filter--checks that ticket has a non-NULL address in user defined fields
+def passes_filters(top, kw_re, kw_min_len):
+    if top.get("userdef1_label") != "Location":
+        return False
+    if top.get("userdef8_label") != "Street Number":
+        return False
+      
+    if is_blank(top.get("userdef1")): # Street Name
+        return False
+    if is_blank(top.get("userdef8")): # Street Number
+        return False
+    desc = top.get("description")
+    if not desc:
+        return False
+    desc = str(desc)
+    if len(desc) < kw_min_len:
+        return False
+    desc = desc.lower()
+    return kw_re.search(desc) is not None
+
+# Extracts address and adds Boston ending to it, for geocoding. Extracts other ticket details too.
+# Returns a tuple in CSV_FIELDS order, ready for csv.writer.
+def extract_row(vid, top):
+    num = str(top.get("userdef8", "")).strip()
+    name = str(top.get("userdef1", "")).strip()
+    address = f"{num} {name}".strip()
+    if address:
+        address += ", Boston, MA"
+    return (
+        vid,
+        top.get("date_utc") or top.get("date", ""),
+        address,
+        top.get("zonenumber", ""),
+        top.get("lpn", ""),
+        top.get("description", ""),
+    )
+
+# CSV is opened once per run behind a 1 MiB buffer; kept rows are written straight through it
+def open_csv():
+    csv_fh = open(CSV_OUT, "a", newline="", encoding="utf-8", buffering=1 << 20)
+    csv_out = csv.writer(csv_fh)
+    if csv_fh.tell() == 0:
+        csv_out.writerow(CSV_FIELDS)
+    return csv_fh, csv_out
+
+# One lookup task per VID, started together so they overlap. Callers await them in VID order and
+# cancel_pending() the rest as soon as they stop, so no request goes out past a stop.
+def start_lookups(session, sem, bucket, vids):
+    return [asyncio.create_task(fetch_search(session, sem, bucket, v)) for v in vids]
+
+def cancel_pending(tasks):
+    for task in tasks:
+        task.cancel()
+
+# Where a probe result stops the skip: "hit" for a keepable ticket, "unknown" for a probe that was
+# throttled or failed (anything but ok/404), None if it came back empty.
+def probe_kind(status, payload, kw_re, kw_min_len):
+    if status == "404":
+        return None
+    if status != "ok":
+        return "unknown"
+    if isinstance(payload, dict) and payload.get("data") and passes_filters(payload["data"][0], kw_re, kw_min_len):
+        return "hit"
+    return None
+
+# Main scraping loop
+async def run_main(config):
+    start = config.start_vid
+    gap_threshold = config.gap_threshold
+    pass_limit = config.pass_limit
+    probe_after = config.probe_after
+    probe_stride = config.probe_stride
+    kw_re, kw_min_len = compile_keywords(config.keywords)
+
+    # Retrieving states from state file
+    state = load_state()
+    current_vid = state.get("last_vid", start)
+    last_date_str = state.get("last_date", "")
+    last_date = parse_date(last_date_str)
+    last_valid_vid = state.get("last_valid_vid", start)
+    pass_count = state.get("pass_count", 0)
+    consecutive_gaps = state.get("gap_count", 0)
+    seen = load_seen()
+    seen_fh = open_seen_log()
+    csv_fh, csv_out = open_csv()
+
+    start_vid = current_vid
+    end_vid = current_vid + config.chunk_size
+    newest_date = last_date
+    newest_vid = None
+    count_403 = 0
+
+    print(f"Pass {pass_count+1}/{pass_limit}: scanning {current_vid} to {end_vid-1}, last_date={last_date_str}, last_valid_vid={last_valid_vid}, seen={len(seen)}")
+
+    sem = asyncio.Semaphore(CONCURRENCY)
+    bucket = TokenBucket(1 / config.request_delay)
+    connector = aiohttp.TCPConnector(limit_per_host=CONCURRENCY, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    # SIGTERM (e.g. a cancelled workflow) cancels the scan the same way Ctrl-C does, so state still gets flushed
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    interrupted = False
+    try:
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+            stop = False
+            hit_threshold = False
+            dense_until = current_vid
+            while current_vid < end_vid and not stop:
+                # Deep in a gap run: sample every probe_stride-th VID instead of walking them one by one
+                if consecutive_gaps >= probe_after and current_vid >= dense_until:
+                    first_vid = current_vid
+                    count = min(BATCH_SIZE, end_vid - current_vid)
+                    vids = range(current_vid, current_vid + count*probe_stride, probe_stride)
+                    tasks = start_lookups(session, sem, bucket, vids)
+                    try:
+                        for stop_vid, task in zip(vids, tasks):
+                            status, payload = await task
+                            if status == "403":
+                                count_403 += 1
+                            kind = probe_kind(status, payload, kw_re, kw_min_len)
+                            if kind:
+                                break
+                    finally:
+                        cancel_pending(tasks)
+                    if kind is None:
+                        current_vid = first_vid + count*probe_stride
+                        print(f"[PROBE] no tickets in {first_vid}-{current_vid-1}, skipping ahead")
+                    elif kind == "hit": # Walk densely from just after the previous probe to one stride past the hit
+                        current_vid = max(first_vid, stop_vid - probe_stride + 1)
+                        dense_until = stop_vid + probe_stride
+                        print(f"[PROBE] ticket at {stop_vid}, scanning {current_vid}-{dense_until-1}")
+                    else: # Probe failed, so its stride is unknown--walk it densely instead of skipping it
+                        current_vid = stop_vid
+                        dense_until = stop_vid + probe_stride
+                        print(f"[PROBE] lookup failed at {stop_vid}, scanning {current_vid}-{dense_until-1}")
+                    # Skipped VIDs (only those covered by empty probes) count as gaps but not against this run's lookup budget
+                    skipped = current_vid - first_vid
+                    consecutive_gaps += skipped
+                    end_vid += skipped - count
+                    if count_403 >= 5:
+                        print("[!] Received 5 consecutive 403s, ending run early.")
+                        break
+                    if consecutive_gaps >= gap_threshold:
+                        hit_threshold = True
+                        break
+                    continue
+
+                batch = range(current_vid, min(current_vid + BATCH_SIZE, end_vid))
+                tasks = start_lookups(session, sem, bucket, batch)
+                try:
+                    for task in tasks:
+                        status, payload = await task
+                        if status == "ok": # Ticket lookup suceeded
+                            data = payload.get("data") if isinstance(payload, dict) else None
+                            if not data:
+                                consecutive_gaps += 1
+                            else: # Filter invalid tickets, parse valid tickets.
+                                top = data[0]
+                                dt = parse_date(top.get("date_utc") or top.get("date"))
+                                if passes_filters(top, kw_re, kw_min_len) and current_vid not in seen:
+                                    consecutive_gaps = 0
+                                    row = extract_row(current_vid, top)
+                                    csv_out.writerow(row)
+                                    mark_seen(seen, seen_fh, current_vid)
+                                    last_valid_vid = current_vid
+                                    print(f"[KEEP] {current_vid} {row[ADDRESS_COL]} {row[DESCRIPTION_COL]}")
+                                    if dt and (newest_date is None or dt > newest_date):
+                                        newest_date = dt
+                                        newest_vid = current_vid
+                                else: # If fails filter, add to gap
+                                  consecutive_gaps += 1
+
+                        elif status == "404":
+                            consecutive_gaps += 1
+
+                        elif status == "403": # Throttling already applied in fetch_search
+                            count_403 += 1
+                            if count_403 >= 5:
+                                print("[!] Received 5 consecutive 403s, ending run early.")
+                                stop = True
+                                break
+
+                        current_vid += 1
+
+                        if consecutive_gaps >= gap_threshold:
+                            hit_threshold = True
+                            stop = True
+                            break
+                finally:
+                    cancel_pending(tasks)
+    except asyncio.CancelledError:
+        interrupted = True
+
+    if interrupted: # Keep last_valid_vid, but leave last_vid/pass_count/gap_count so the range is rescanned without double-counting its gaps
+        print(f"[!] Interrupted at VID={current_vid}, saving state")
+        close_log(csv_fh)
+        close_log(seen_fh)
+        state["last_valid_vid"] = last_valid_vid
+        save_state(state)
+        return
+
+    if hit_threshold: # If we hit 10,000 gaps
+        print(f"[!] Hit {gap_threshold} gaps")
+        consecutive_gaps = 0
+        if last_valid_vid:
+            current_vid = last_valid_vid
+            print(f"Rolling back to last_valid_vid={last_valid_vid}")
+        elif newest_vid: # If newer VID found during current scraping, go to it
+            current_vid = newest_vid
+            print(f"Rolling back to newest_vid={newest_vid}")
+        else:
+            current_vid = start
+            print(f"Rolling back to start_vid={start}")
+
+        # Save current state and end this scraping job
+        close_log(csv_fh)
+        close_log(seen_fh)
+        state["last_vid"] = current_vid
+        state["pass_count"] = 0
+        state["gap_count"] = consecutive_gaps
+        save_state(state)
+        return
+
+    close_log(csv_fh)
+    close_log(seen_fh)
+    state["last_valid_vid"] = last_valid_vid
+    state["gap_count"] = consecutive_gaps
+
+    # Pass management
+    pass_count += 1
+    if pass_count >= pass_limit:
+        if newest_date and (last_date is None or newest_date > last_date): # If newer ticket found based on date, advance to this VID
+            last_date_str = newest_date.isoformat()
+            state["last_date"] = last_date_str
+            if newest_vid:
+                next_vid = newest_vid
+                print(f"Updated last_date: {last_date_str}, advancing to newest_vid={newest_vid}")
+            else:
+                next_vid = end_vid
+                print(f"Updated last_date: {last_date_str}, probing forward to {end_vid}")
+        else:
+            next_vid = end_vid
+            print(f"No newer dates, probing forward to {end_vid}")
+        pass_count = 0
+    else:
+        next_vid = start_vid
+        print(f"Repeating pass {pass_count}/{pass_limit} around VID={next_vid}")
+    state["last_vid"] = next_vid
+    state["pass_count"] = pass_count
+    save_state(state)
+
+    print(f"Done. consecutive_gaps={consecutive_gaps}, next start={next_vid}, last_valid_vid={last_valid_vid}, last_date={last_date_str}")
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import scraper_core
+
+
+def test_back_off_holds_task_waiting_in_acquire(monkeypatch):
+    monkeypatch.setattr(scraper_core, "BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(scraper_core.random, "random", lambda: 0.0)
+
+    async def scenario():
+        bucket = scraper_core.TokenBucket(1 / 0.2)
+        t0 = time.monotonic()
+        await bucket.acquire()  # first slot, immediately
+        waiter = asyncio.create_task(bucket.acquire())  # sleeps until t0 + 0.2
+        await asyncio.sleep(0.05)
+        bucket.back_off("429", retry_after=0.5)  # server cooldown until ~t0 + 0.55
+        await waiter
+        return time.monotonic() - t0
+
+    assert asyncio.run(scenario()) >= 0.54
+
+
+KW_RE, KW_MIN_LEN = scraper_core.compile_keywords(("meter fee unpaid",))
+TICKET = {"data": [{"userdef1_label": "Location", "userdef8_label": "Street Number",
+                    "userdef1": "BOYLSTON ST", "userdef8": "500", "description": "332 Meter Fee Unpaid"}]}
+
+
+def test_probe_kind_skips_empty_probes():
+    assert scraper_core.probe_kind("ok", {"data": []}, KW_RE, KW_MIN_LEN) is None
+    assert scraper_core.probe_kind("404", None, KW_RE, KW_MIN_LEN) is None
+
+
+def test_probe_kind_reports_hit():
+    assert scraper_core.probe_kind("ok", TICKET, KW_RE, KW_MIN_LEN) == "hit"
+
+
+def test_probe_kind_treats_failed_probe_as_unknown():
+    for status in ("403", "429", "err"):
+        assert scraper_core.probe_kind(status, None, KW_RE, KW_MIN_LEN) == "unknown"
+
+
+def test_back_off_uses_retry_after_even_when_shorter(monkeypatch):
+    monkeypatch.setattr(scraper_core.random, "random", lambda: 1.0)  # fallback would be >= 3s
+    bucket = scraper_core.TokenBucket(1.0)
+    before = time.monotonic()
+    bucket.back_off("429", retry_after=0.5)
+    assert bucket.next - before < 1.0
+
+
+def test_back_off_caps_retry_after():
+    bucket = scraper_core.TokenBucket(1.0)
+    before = time.monotonic()
+    bucket.back_off("429", retry_after=scraper_core.RETRY_AFTER_MAX * 10)
+    assert bucket.next - before <= scraper_core.RETRY_AFTER_MAX + 0.1
+
+
+def test_back_off_falls_back_to_exponential_without_retry_after(monkeypatch):
+    monkeypatch.setattr(scraper_core.random, "random", lambda: 0.0)
+    bucket = scraper_core.TokenBucket(1.0)
+    before = time.monotonic()
+    bucket.back_off("429")
+    bucket.back_off("429")
+    assert bucket.next - before >= 2 * scraper_core.BACKOFF_BASE - 0.01
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.headers = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# Stands in for aiohttp.ClientSession: every request gets `status`, and its URL is recorded in `sent`
+def fake_session(status, sent):
+    class FakeSession:
+        def __init__(self, connector, headers):
+            self.connector = connector
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            await self.connector.close()
+
+        def get(self, url, timeout):
+            sent.append(url)
+            return FakeResponse(status)
+
+    return FakeSession
+
+
+def test_run_main_stops_sending_after_five_403s(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraper_core, "BACKOFF_BASE", 0.0)
+    monkeypatch.setattr(scraper_core.random, "random", lambda: 0.0)
+    sent = []
+    monkeypatch.setattr(scraper_core.aiohttp, "ClientSession", fake_session(403, sent))
+    config = scraper_core.ScrapeConfig(start_vid=0, keywords=("meter fee unpaid",), request_delay=0.05)
+    asyncio.run(scraper_core.run_main(config))
+    assert len(sent) == 5
+
+
+def test_parse_date_ignores_non_string_values():
+    assert scraper_core.parse_date({"value": "2025-01-01"}) is None
+    assert scraper_core.parse_date(["2025-01-01"]) is None
+    assert scraper_core.parse_date("2025-01-01T10:00:00Z").year == 2025
+
+
+# Runs run_main against a monkeypatched fetch_search: `results` maps VID -> (status, payload), anything
+# else is a 404. Returns the saved state, the VIDs written to the CSV and the VIDs that were looked up.
+def run_scan(monkeypatch, tmp_path, results, state, **config):
+    monkeypatch.chdir(tmp_path)
+    fetched = []
+
+    async def fake_fetch(session, sem, bucket, vid):
+        fetched.append(vid)
+        return results.get(vid, ("404", None))
+
+    monkeypatch.setattr(scraper_core, "fetch_search", fake_fetch)
+    scraper_core.save_state(state)
+    config = scraper_core.ScrapeConfig(start_vid=0, keywords=("meter fee unpaid",), pass_limit=1,
+                                       probe_after=5, probe_stride=10, **config)
+    asyncio.run(scraper_core.run_main(config))
+    with open(scraper_core.CSV_OUT) as f:
+        kept = [int(line.split(",")[0]) for line in f.read().splitlines()[1:]]
+    return scraper_core.load_state(), kept, fetched
+
+
+def test_run_main_skips_span_covered_by_empty_probes(monkeypatch, tmp_path):
+    state, kept, fetched = run_scan(monkeypatch, tmp_path, {}, {"last_vid": 0, "gap_count": 5}, chunk_size=20)
+    assert fetched == list(range(0, 200, 10))
+    assert kept == []
+    # 200 VIDs skipped for the 20 probes sent, so end_vid moves from 20 to 200
+    assert state["last_vid"] == 200
+    assert state["gap_count"] == 205
+
+
+def test_run_main_walks_densely_around_probe_hit(monkeypatch, tmp_path):
+    results = {40: ("ok", TICKET), 45: ("ok", TICKET)}
+    state, kept, fetched = run_scan(monkeypatch, tmp_path, results, {"last_vid": 0, "gap_count": 5}, chunk_size=40)
+    assert kept == [40, 45]
+    assert [v for v in fetched if v % 10] == [v for v in range(31, 51) if v % 10]
+    # Probes 0-30 skip 31 VIDs, so the 20 dense lookups left in the budget cover 31-50
+    assert state["last_vid"] == 51
+    assert state["gap_count"] == 5
+
+
+def test_run_main_walks_failed_probe_stride_densely(monkeypatch, tmp_path):
+    results = {30: ("429", None), 35: ("ok", TICKET)}
+    state, kept, fetched = run_scan(monkeypatch, tmp_path, results, {"last_vid": 0, "gap_count": 5}, chunk_size=40)
+    assert kept == [35]
+    assert state["last_vid"] == 50
+    assert state["gap_count"] == 14
+
+
+def test_run_main_rolls_back_when_probes_cross_gap_threshold(monkeypatch, tmp_path):
+    state, kept, fetched = run_scan(monkeypatch, tmp_path, {}, {"last_vid": 0, "gap_count": 5, "last_valid_vid": 7},
+                                    chunk_size=20, gap_threshold=100)
+    assert state["last_vid"] == 7
+    assert state["gap_count"] == 0
+    assert state["pass_count"] == 0
+
+
+def test_run_main_interrupt_keeps_gap_count_with_unadvanced_last_vid(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    async def fake_fetch(session, sem, bucket, vid):
+        if vid == 10:
+            raise asyncio.CancelledError
+        return ("404", None)
+
+    monkeypatch.setattr(scraper_core, "fetch_search", fake_fetch)
+    scraper_core.save_state({"last_vid": 0, "gap_count": 3})
+    asyncio.run(scraper_core.run_main(scraper_core.ScrapeConfig(start_vid=0, keywords=("meter fee unpaid",))))
+    state = scraper_core.load_state()
+    assert state["last_vid"] == 0
+    assert state["gap_count"] == 3